@@ -1,10 +1,65 @@
 import os
+import re
+import hmac
+import json
+import time
+import queue
+import atexit
+import logging
+import threading
+from logging.handlers import QueueHandler, QueueListener
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import quote
+
+import orjson
 import requests
-import gspread
+import ahocorasick
 from flask import Flask, request, jsonify
+from flask.json.provider import JSONProvider
 from google.oauth2.service_account import Credentials
+from google.auth.transport.requests import AuthorizedSession
+from requests.adapters import HTTPAdapter
+from urllib3.exceptions import NewConnectionError
+
+
+class OrjsonProvider(JSONProvider):
+    """
+    Parses webhook payloads and renders JSON responses with orjson,
+    which is several times faster than the standard json module.
+    """
+
+    def dumps(self, obj, **kwargs):
+        return orjson.dumps(obj).decode()
+
+    def loads(self, s, **kwargs):
+        return orjson.loads(s)
+
 
 app = Flask(__name__)
+app.json = OrjsonProvider(app)
+
+# ============================================================
+#  LOGGING
+#  Records are handed to a queue and written to stderr by a
+#  background thread, so request threads never block on output.
+#  Set LOG_LEVEL=WARNING to only see problems.
+# ============================================================
+
+_LOG_QUEUE   = queue.SimpleQueue()
+_LOG_HANDLER = logging.StreamHandler()
+_LOG_HANDLER.setFormatter(logging.Formatter("%(asctime)s %(levelname)s %(message)s"))
+
+# The queue side only renders the message; timestamps are added on output
+_QUEUE_HANDLER = QueueHandler(_LOG_QUEUE)
+_QUEUE_HANDLER.setFormatter(logging.Formatter("%(message)s"))
+
+_LOG_LISTENER = QueueListener(_LOG_QUEUE, _LOG_HANDLER)
+_LOG_LISTENER.start()
+atexit.register(_LOG_LISTENER.stop)
+
+logging.basicConfig(level=os.getenv("LOG_LEVEL", "INFO").upper(), handlers=[_QUEUE_HANDLER])
+logger = logging.getLogger(__name__)
 
 # ============================================================
 #  CONFIGURATION — fill these in with your own values
@@ -15,6 +70,33 @@ VERIFY_TOKEN      = os.getenv("VERIFY_TOKEN")
 SPREADSHEET_ID    = os.getenv("SPREADSHEET_ID")
 CREDENTIALS_FILE = "/etc/secrets/credentials.json" if os.path.exists("/etc/secrets/credentials.json") else "credentials.json"
 
+# How long (in seconds) sheet rows are kept in memory before re-fetching.
+# Edits to the Sheet show up in the bot after at most this many seconds.
+SHEET_CACHE_TTL   = int(os.getenv("SHEET_CACHE_TTL", 60))
+
+# After a failed Sheets fetch, wait this many seconds before trying again
+SHEET_RETRY_SECONDS = 10
+
+# Cells to read. With no sheet name this is the first tab of the spreadsheet.
+SHEET_RANGE       = os.getenv("SHEET_RANGE", "A:B")
+
+# Max seconds to wait on a Graph API call before giving up
+GRAPH_API_TIMEOUT  = 5
+
+# Max seconds to wait on a Sheets API call before giving up
+SHEETS_API_TIMEOUT = 5
+
+# Number of background threads that look up and send replies
+EVENT_WORKERS     = int(os.getenv("EVENT_WORKERS", 16))
+
+# Max Graph API requests per second, per server process. Keeps bursts
+# under Facebook's page rate limit instead of failing with error #32.
+GRAPH_RATE_LIMIT  = float(os.getenv("GRAPH_RATE_LIMIT", 500))
+
+# Repeated greetings from the same user within this many seconds
+# (e.g. "hi" sent twice) only get one welcome message.
+GREETING_COALESCE_SECONDS = 0.5
+
 FALLBACK_MESSAGE  = "Sorry, I didn't quite understand that. 😅 Please choose from the options below or contact us directly!"
 
 # ============================================================
@@ -24,6 +106,15 @@ FALLBACK_MESSAGE  = "Sorry, I didn't quite understand that. 😅 Please choose f
 
 GREETING_KEYWORDS = ["hi", "hello", "hey", "start", "help", "menu"]
 
+# Matches any greeting as a whole word, so "hi" no longer fires on "this"
+_GREETING_RE = re.compile(
+    r"\b(?:" + "|".join(map(re.escape, GREETING_KEYWORDS)) + r")\b",
+    re.IGNORECASE,
+)
+
+# Sent when a greeting is detected. {name} is the user's first name.
+WELCOME_MESSAGE   = "👋 Hi, {name}! How can we help you today? Choose an option below or type your question:"
+
 # ============================================================
 #  QUICK REPLY BUTTONS
 #  These appear as floating button suggestions in Messenger.
@@ -60,9 +151,32 @@ PAYLOAD_REPLIES = {
 #  GOOGLE SHEETS — KEYWORD LOOKUP
 # ============================================================
 
-def get_sheet_data():
+_SHEET_CACHE    = {"automaton": None, "expires": 0.0}
+_SHEET_LOCK     = threading.Lock()
+_SHEETS_SESSION = None  # authorized HTTP session, created once on first use
+
+
+def _get_sheets_session():
+    """
+    Returns an HTTP session authorized with the service account,
+    building the credentials only once. The session refreshes the
+    OAuth token on its own, so it can be reused for every fetch.
+
+    Only called with _SHEET_LOCK held, so the session is never
+    built twice.
+    """
+    global _SHEETS_SESSION
+    if _SHEETS_SESSION is None:
+        scopes = ["https://www.googleapis.com/auth/spreadsheets.readonly"]
+        creds  = Credentials.from_service_account_file(CREDENTIALS_FILE, scopes=scopes)
+        _SHEETS_SESSION = AuthorizedSession(creds)
+    return _SHEETS_SESSION
+
+
+def _fetch_sheet_rows():
     """
-    Reads keyword-reply pairs from Google Sheets.
+    Reads keyword-reply pairs from Google Sheets, including the
+    header row, with a single Sheets API values.get call.
 
     Your Sheet1 should have two columns (with a header row):
       Column A: Keyword
@@ -74,67 +188,266 @@ def get_sheet_data():
       price       | Our pricing starts at $99/month...
       hours       | We're open Mon-Fri, 9am to 6pm.
       location    | We're at 123 Main St, Manila!
+
+    SHEET_RANGE sets which cells are read (columns A and B of the
+    first tab by default).
+    """
+    url = f"https://sheets.googleapis.com/v4/spreadsheets/{SPREADSHEET_ID}/values/{quote(SHEET_RANGE, safe='!:')}"
+    response = _get_sheets_session().get(url, timeout=SHEETS_API_TIMEOUT)
+    response.raise_for_status()
+    # "values" is left out entirely when the range is empty
+    return orjson.loads(response.content).get("values", [])
+
+
+def _normalize_rows(rows):
+    """
+    Turns raw sheet rows into (keyword, reply) pairs, with the keyword
+    lowercased and both sides stripped. Rows without a keyword or reply
+    column are dropped. Done once per fetch, not once per message.
+    """
+    return [
+        (row[0].strip().lower(), row[1].strip())
+        for row in rows
+        if len(row) >= 2 and row[0].strip()
+    ]
+
+
+def _build_keyword_automaton(keywords):
+    """
+    Builds an Aho–Corasick automaton over the sheet keywords so a message
+    can be checked against every keyword in a single pass.
+
+    Each keyword maps to (position, reply); the position lets the
+    lookup keep the old "first matching row wins" behaviour.
+    Returns None if the sheet has no usable keywords.
     """
-    scopes = ["https://www.googleapis.com/auth/spreadsheets.readonly"]
-    creds  = Credentials.from_service_account_file(CREDENTIALS_FILE, scopes=scopes)
-    client = gspread.authorize(creds)
-    sheet  = client.open_by_key(SPREADSHEET_ID).sheet1
-    rows   = sheet.get_all_values()
-    return rows[1:]  # Skip the header row
+    if not keywords:
+        return None
+
+    automaton = ahocorasick.Automaton()
+
+    for position, (keyword, reply) in enumerate(keywords):
+        if keyword not in automaton:
+            automaton.add_word(keyword, (position, reply))
+
+    automaton.make_automaton()
+    return automaton
+
+
+def _get_sheet_cache():
+    """
+    Returns the cached keyword automaton, re-fetching the sheet from
+    Google Sheets once it is older than SHEET_CACHE_TTL seconds, so
+    normal messages don't wait on (or use up quota for) a Sheets call.
+
+    If a refresh fails, the previous automaton is kept and the fetch
+    is retried after SHEET_RETRY_SECONDS.
+    """
+    global _SHEET_CACHE
+
+    cache = _SHEET_CACHE
+    if time.monotonic() < cache["expires"]:
+        return cache
+
+    with _SHEET_LOCK:
+        # Another thread may have refreshed the cache while we waited
+        cache = _SHEET_CACHE
+        if time.monotonic() < cache["expires"]:
+            return cache
+
+        try:
+            rows = _fetch_sheet_rows()[1:]  # Skip the header row
+        except Exception as e:
+            # Keep serving the last good data (if any) and hold off on
+            # retrying, so an outage doesn't queue every message up
+            # behind its own slow, failing fetch.
+            logger.error("Google Sheets refresh failed: %s", e)
+            cache = {
+                "automaton": cache["automaton"],
+                "expires":   time.monotonic() + SHEET_RETRY_SECONDS,
+            }
+            _SHEET_CACHE = cache
+            return cache
+
+        cache = {
+            "automaton": _build_keyword_automaton(_normalize_rows(rows)),
+            "expires":   time.monotonic() + SHEET_CACHE_TTL,
+        }
+        _SHEET_CACHE = cache
+        return cache
 
 
 def find_reply_from_sheet(user_message):
     """
     Scans the Google Sheet for a keyword that appears in
     the user's message. Returns the reply if found, or None.
+
+    If several keywords appear, the one highest up in the sheet wins.
     """
     try:
-        rows = get_sheet_data()
-        user_message_lower = user_message.lower()
+        automaton = _get_sheet_cache()["automaton"]
+        if automaton is None:
+            return None
 
-        for row in rows:
-            if len(row) < 2:
-                continue
-            keyword = row[0].strip().lower()
-            reply   = row[1].strip()
-            if keyword and keyword in user_message_lower:
-                return reply
+        best = None
+        for _, match in automaton.iter(user_message.lower()):
+            if best is None or match[0] < best[0]:
+                best = match
+                # Nothing can beat the top row, so stop scanning
+                if best[0] == 0:
+                    break
+
+        if best is not None:
+            return best[1]
 
     except Exception as e:
-        print(f"[ERROR] Google Sheets lookup failed: {e}")
+        logger.error("Google Sheets lookup failed: %s", e)
 
     return None  # No match found
 
 
 # ============================================================
-#  FACEBOOK GRAPH API — GET USER'S FIRST NAME
+#  FACEBOOK GRAPH API — SHARED HTTP SESSION
+#  Reusing one session keeps the TLS connection to
+#  graph.facebook.com open between messages.
+#  The pool holds one connection per event worker, so a burst
+#  of replies never has to open (and then throw away) extra
+#  connections.
 # ============================================================
 
-def get_user_name(sender_id):
+_SESSION = requests.Session()
+_SESSION.mount("https://", HTTPAdapter(pool_connections=4, pool_maxsize=EVENT_WORKERS))
+
+
+# ============================================================
+#  FACEBOOK GRAPH API — RATE LIMIT
+#  A token bucket shared by all threads: it refills at
+#  GRAPH_RATE_LIMIT tokens per second, and every Graph request
+#  takes one token, waiting if none are left.
+# ============================================================
+
+_GRAPH_BUCKET      = {"tokens": GRAPH_RATE_LIMIT, "updated": time.monotonic()}
+_GRAPH_BUCKET_LOCK = threading.Lock()
+
+
+def _wait_for_graph_slot(requests_needed=1):
     """
-    Fetches the sender's first name from Facebook's Graph API.
-    Falls back to 'there' if the name can't be retrieved,
-    so the greeting still reads naturally: "Hi, there!"
+    Blocks until requests_needed Graph API requests may be made
+    without going over GRAPH_RATE_LIMIT.
     """
-    url    = f"https://graph.facebook.com/{sender_id}"
-    params = {
-        "fields":       "first_name",
-        "access_token": PAGE_ACCESS_TOKEN
-    }
-    try:
-        response = requests.get(url, params=params)
-        if response.status_code == 200:
-            return response.json().get("first_name", "there")
-    except Exception as e:
-        print(f"[ERROR] Could not fetch user name: {e}")
+    # The bucket never holds more than GRAPH_RATE_LIMIT tokens
+    requests_needed = min(requests_needed, GRAPH_RATE_LIMIT)
+
+    while True:
+        with _GRAPH_BUCKET_LOCK:
+            now    = time.monotonic()
+            tokens = min(
+                GRAPH_RATE_LIMIT,
+                _GRAPH_BUCKET["tokens"] + (now - _GRAPH_BUCKET["updated"]) * GRAPH_RATE_LIMIT,
+            )
+            _GRAPH_BUCKET["updated"] = now
 
-    return "there"
+            if tokens >= requests_needed:
+                _GRAPH_BUCKET["tokens"] = tokens - requests_needed
+                return
+
+            _GRAPH_BUCKET["tokens"] = tokens
+            wait = (requests_needed - tokens) / GRAPH_RATE_LIMIT
+
+        time.sleep(wait)
+
+
+# ============================================================
+#  USER FIRST NAMES
+#  Filled in by the welcome batch (see _send_welcome_batch).
+# ============================================================
+
+# First names rarely change, so each one is looked up only once.
+# The oldest entries are dropped once the cache is full.
+USER_NAME_CACHE_SIZE = 10_000
+
+# When a name can't be fetched, "there" is used for this many seconds
+# before the lookup is tried again.
+USER_NAME_RETRY_SECONDS = 600
+
+_USER_NAMES      = OrderedDict()  # sender_id → (name, expiry time or None)
+_USER_NAMES_LOCK = threading.Lock()
+
+
+def _get_cached_user_name(sender_id):
+    """Returns the cached first name for sender_id, or None."""
+    with _USER_NAMES_LOCK:
+        entry = _USER_NAMES.get(sender_id)
+        if entry is None:
+            return None
+
+        name, expires = entry
+        if expires is not None and time.monotonic() >= expires:
+            del _USER_NAMES[sender_id]
+            return None
+
+        _USER_NAMES.move_to_end(sender_id)
+        return name
+
+
+def _cache_user_name(sender_id, name, ttl=None):
+    """
+    Remembers a first name. Fetched names are kept for good; pass a
+    ttl (in seconds) for stand-ins such as "there".
+    """
+    expires = None if ttl is None else time.monotonic() + ttl
+    with _USER_NAMES_LOCK:
+        _USER_NAMES[sender_id] = (name, expires)
+        _USER_NAMES.move_to_end(sender_id)
+        if len(_USER_NAMES) > USER_NAME_CACHE_SIZE:
+            _USER_NAMES.popitem(last=False)
 
 
 # ============================================================
 #  MESSENGER SEND API
 # ============================================================
 
+def _format_quick_replies(quick_replies):
+    """Converts quick_replies into the Send API's button format."""
+    return [
+        {
+            "content_type": "text",
+            "title":        qr["title"],
+            "payload":      qr["payload"]
+        }
+        for qr in quick_replies
+    ]
+
+
+# Nearly every reply carries QUICK_REPLY_BUTTONS, so format them once
+_QUICK_REPLY_BUTTONS_FORMATTED = _format_quick_replies(QUICK_REPLY_BUTTONS)
+
+
+def _build_message(message_text, quick_replies=None):
+    """
+    Builds the "message" object for the Send API, attaching
+    quick reply buttons if provided.
+    """
+    message = {"text": message_text}
+
+    if quick_replies is QUICK_REPLY_BUTTONS:
+        message["quick_replies"] = _QUICK_REPLY_BUTTONS_FORMATTED
+    elif quick_replies:
+        message["quick_replies"] = _format_quick_replies(quick_replies)
+
+    return message
+
+
+# The URL (with the encoded access token) and headers never change,
+# so they are built once instead of on every send.
+# The payload itself is built per call, since workers send in parallel.
+_SEND_API_URL = (
+    "https://graph.facebook.com/v19.0/me/messages?access_token="
+    + quote(PAGE_ACCESS_TOKEN or "", safe="")
+)
+_JSON_HEADERS = {"Content-Type": "application/json"}
+
+
 def send_message(recipient_id, message_text, quick_replies=None):
     """
     Sends a text message to the user via the Messenger Send API.
@@ -143,53 +456,308 @@ def send_message(recipient_id, message_text, quick_replies=None):
     quick_replies format:
       [{"title": "Button Label", "payload": "PAYLOAD_KEY"}, ...]
     """
-    url     = "https://graph.facebook.com/v19.0/me/messages"
-    headers = {"Content-Type": "application/json"}
-    params  = {"access_token": PAGE_ACCESS_TOKEN}
-
-    message = {"text": message_text}
-
-    if quick_replies:
-        message["quick_replies"] = [
-            {
-                "content_type": "text",
-                "title":        qr["title"],
-                "payload":      qr["payload"]
-            }
-            for qr in quick_replies
-        ]
-
     payload = {
         "recipient":      {"id": recipient_id},
-        "message":        message,
+        "message":        _build_message(message_text, quick_replies),
         "messaging_type": "RESPONSE"
     }
 
-    response = requests.post(url, headers=headers, json=payload, params=params)
+    try:
+        _wait_for_graph_slot()
+        response = _SESSION.post(
+            _SEND_API_URL, headers=_JSON_HEADERS, data=orjson.dumps(payload),
+            timeout=GRAPH_API_TIMEOUT
+        )
+    except Exception as e:
+        logger.error("Failed to send message: %s", e)
+        return
 
     if response.status_code != 200:
-        print(f"[ERROR] Failed to send message: {response.status_code} — {response.text}")
+        logger.error("Failed to send message: %s — %s", response.status_code, response.text)
     else:
-        print(f"[OK] Replied to {recipient_id}: {message_text[:60]}...")
+        logger.info("Replied to %s: %.60s...", recipient_id, message_text)
+
+
+def _failed_before_sending(error):
+    """
+    Returns True if a requests.ConnectionError happened before any of
+    the request was sent: a connect timeout, a refused connection or a
+    DNS failure. Anything else (e.g. a dropped connection) might have
+    happened after Facebook got the request.
+    """
+    if isinstance(error, requests.ConnectTimeout):
+        return True
+    cause = error.args[0] if error.args else None
+    return isinstance(getattr(cause, "reason", None), NewConnectionError)
+
+
+# Placeholder swapped for a Graph batch reference to the user's first name
+_NAME_MARKER = "@@FIRST_NAME@@"
+
+
+def _send_welcome_batch(recipient_id):
+    """
+    Looks up the user's first name and sends the welcome message in a
+    single Graph API batch request, instead of two round-trips.
+
+    The message text refers to the first request's result, so Graph
+    fills in the name itself. Returns True if the welcome was sent, or
+    if it may have been (e.g. the response timed out), so that it isn't
+    sent twice. Returns False only when it definitely wasn't sent.
+    """
+    message = _build_message(
+        WELCOME_MESSAGE.format(name=_NAME_MARKER), quick_replies=QUICK_REPLY_BUTTONS
+    )
+    before, after = json.dumps(message, ensure_ascii=False).split(_NAME_MARKER)
+
+    # The reference must stay un-encoded so Graph can substitute it
+    body = (
+        "recipient=" + quote(json.dumps({"id": recipient_id}))
+        + "&messaging_type=RESPONSE"
+        + "&message=" + quote(before) + "{result=user:$.first_name}" + quote(after)
+    )
+
+    batch = [
+        {
+            "method":                   "GET",
+            "name":                     "user",
+            "relative_url":             f"{recipient_id}?fields=first_name",
+            "omit_response_on_success": False,
+        },
+        {
+            "method":       "POST",
+            "relative_url": "me/messages",
+            "body":         body,
+        },
+    ]
+
+    try:
+        # Each request inside a batch counts towards the rate limit
+        _wait_for_graph_slot(len(batch))
+        response = _SESSION.post(
+            "https://graph.facebook.com/v19.0/",
+            data={"batch": json.dumps(batch), "access_token": PAGE_ACCESS_TOKEN},
+            timeout=GRAPH_API_TIMEOUT,
+        )
+    except requests.ConnectionError as e:
+        if not _failed_before_sending(e):
+            # The request may have gone through; don't risk a second welcome
+            logger.error("Welcome batch outcome unknown, not resending: %s", e)
+            return True
+        # Never reached Facebook, so nothing was sent
+        logger.error("Welcome batch failed: %s", e)
+        return False
+    except Exception as e:
+        # The request may have gone through; don't risk a second welcome
+        logger.error("Welcome batch outcome unknown, not resending: %s", e)
+        return True
+
+    if response.status_code != 200:
+        logger.error("Welcome batch failed: %s — %s", response.status_code, response.text)
+        return False
+
+    try:
+        user_result, send_result = response.json()
+    except Exception as e:
+        logger.error("Welcome batch outcome unknown, not resending: %s", e)
+        return True
+
+    # Cache the name, or the lack of one, whether or not the send worked,
+    # so the next greeting (or the fallback below) can skip the lookup
+    try:
+        name = json.loads(user_result["body"])["first_name"]
+        _cache_user_name(recipient_id, name)
+    except Exception as e:
+        name = "there"
+        logger.warning("Could not read the name of %s: %s", recipient_id, e)
+        _cache_user_name(recipient_id, name, ttl=USER_NAME_RETRY_SECONDS)
+
+    if not send_result or send_result.get("code") != 200:
+        logger.error("Welcome batch could not send message: %s", send_result)
+        return False
+
+    logger.info("Welcomed %s (%s)", recipient_id, name)
+    return True
 
 
 def send_welcome(recipient_id):
     """
     Sends a personalized welcome message with quick reply buttons.
     Fetches the user's first name first for a personal touch.
+
+    If the name is already cached, only the message is sent.
+    Otherwise the name lookup and the message go out as one batch
+    request. If that fails (e.g. the name isn't available), the
+    welcome is sent on its own, with the usual "there" fallback if
+    the name couldn't be fetched.
     """
-    name = get_user_name(recipient_id)
+    name = _get_cached_user_name(recipient_id)
+    if name is None:
+        if _send_welcome_batch(recipient_id):
+            return
+        name = _get_cached_user_name(recipient_id) or "there"
+
     send_message(
         recipient_id,
-        f"👋 Hi, {name}! How can we help you today? Choose an option below or type your question:",
+        WELCOME_MESSAGE.format(name=name),
         quick_replies=QUICK_REPLY_BUTTONS
     )
 
 
+# ============================================================
+#  EVENT PROCESSING
+#  Runs on background threads, after Meta has had its 200.
+# ============================================================
+
+_EXECUTOR = ThreadPoolExecutor(max_workers=EVENT_WORKERS, thread_name_prefix="event")
+
+
+def _warm_sheet_cache():
+    """
+    Loads the service account credentials, the OAuth token and the sheet
+    once at startup, so the first user message doesn't pay for them.
+    """
+    try:
+        _get_sheet_cache()
+    except Exception as e:
+        logger.warning("Could not preload Google Sheet: %s", e)
+
+
+if SPREADSHEET_ID:
+    _EXECUTOR.submit(_warm_sheet_cache)
+
+
+_LAST_WELCOME      = {}  # sender_id → when the greeting we last welcomed arrived
+_LAST_WELCOME_LOCK = threading.Lock()
+
+
+def _claim_welcome(sender_id, received_at):
+    """
+    Returns True if sender_id should get a welcome message for a
+    greeting that reached the webhook at received_at (time.monotonic()),
+    or False if it arrived within GREETING_COALESCE_SECONDS of the
+    greeting they were last welcomed for.
+
+    Arrival times are compared, not processing times, because a
+    sender's events wait for their earlier replies to be sent first.
+    """
+    with _LAST_WELCOME_LOCK:
+        now  = time.monotonic()
+        last = _LAST_WELCOME.get(sender_id)
+        if last is not None and received_at - last < GREETING_COALESCE_SECONDS:
+            return False
+
+        # Forget old entries now and then so the dict stays small
+        if len(_LAST_WELCOME) >= 1000:
+            for stale_id in [sid for sid, t in _LAST_WELCOME.items()
+                             if now - t >= GREETING_COALESCE_SECONDS]:
+                del _LAST_WELCOME[stale_id]
+
+        _LAST_WELCOME[sender_id] = received_at
+        return True
+
+
+def _process_event(event, received_at):
+    """
+    Handles a single Messenger event, which reached the webhook at
+    received_at (time.monotonic()).
+
+    Only user messages get this far; handle_message has already
+    dropped echoes, deliveries, reads and other event types.
+
+    Flow:
+      1. Extract sender ID + message from the event
+      2. If it's a quick reply button tap → use PAYLOAD_REPLIES
+      3. If it's a greeting → send welcome message with buttons
+      4. Otherwise → look up a reply in Google Sheets
+      5. If nothing matches → send the fallback message (with buttons)
+    """
+    try:
+        sender_id = event["sender"]["id"]
+        msg       = event["message"]
+
+        # ── CASE 1: User tapped a Quick Reply button ──────────────
+        if "quick_reply" in msg:
+            reply = PAYLOAD_REPLIES.get(msg["quick_reply"]["payload"], FALLBACK_MESSAGE)
+
+        # ── CASE 2: Text message ───────────────────────────────────
+        else:
+            user_text = msg.get("text")
+            if not user_text:
+                return
+
+            logger.info("Message from %s: %.60s", sender_id, user_text)
+
+            # Check if it's a greeting → send personalized welcome
+            if _GREETING_RE.search(user_text):
+                if _claim_welcome(sender_id, received_at):
+                    send_welcome(sender_id)
+                return
+
+            # Look up a reply in Google Sheets, or fall back if nothing matches
+            reply = find_reply_from_sheet(user_text) or FALLBACK_MESSAGE
+
+        # Always show buttons again so user can keep exploring
+        send_message(sender_id, reply, quick_replies=QUICK_REPLY_BUTTONS)
+
+    except Exception as e:
+        # Nobody waits on the worker, so errors would vanish otherwise
+        logger.exception("Failed to process event: %s", e)
+
+
+_SENDER_QUEUES      = {}  # sender_id → deque of (received_at, event) still to handle
+_SENDER_QUEUES_LOCK = threading.Lock()
+
+
+def _queue_events(sender_id, events, received_at):
+    """
+    Queues a sender's events behind any of theirs still being handled,
+    across webhook deliveries. Only one worker at a time works through
+    a sender's queue, so their replies go out in the order received.
+
+    The queues live in this process only; with several gunicorn
+    processes (see gunicorn.conf.py), order isn't kept between them.
+    """
+    with _SENDER_QUEUES_LOCK:
+        pending = _SENDER_QUEUES.get(sender_id)
+        entries = [(received_at, event) for event in events]
+        if pending is not None:
+            # A worker is already on this sender and will pick these up
+            pending.extend(entries)
+            return
+        _SENDER_QUEUES[sender_id] = deque(entries)
+
+    _EXECUTOR.submit(_process_events, sender_id)
+
+
+def _process_events(sender_id):
+    """Handles a sender's queued events one after the other, until none are left."""
+    while True:
+        with _SENDER_QUEUES_LOCK:
+            pending = _SENDER_QUEUES[sender_id]
+            if not pending:
+                del _SENDER_QUEUES[sender_id]
+                return
+            received_at, event = pending.popleft()
+
+        _process_event(event, received_at)
+
+
 # ============================================================
 #  WEBHOOK ENDPOINTS
 # ============================================================
 
+def _token_matches(token):
+    """
+    Compares the token Meta sent against VERIFY_TOKEN in constant time,
+    so the response time doesn't reveal how much of it was right.
+    An unset VERIFY_TOKEN never matches.
+    """
+    if not token or not VERIFY_TOKEN:
+        return False
+    return hmac.compare_digest(token.encode(), VERIFY_TOKEN.encode())
+
+
 @app.route("/webhook", methods=["GET"])
 def verify_webhook():
     """
@@ -200,11 +768,11 @@ def verify_webhook():
     token     = request.args.get("hub.verify_token")
     challenge = request.args.get("hub.challenge")
 
-    if mode == "subscribe" and token == VERIFY_TOKEN:
-        print("[OK] Webhook verified!")
+    if mode == "subscribe" and _token_matches(token):
+        logger.info("Webhook verified!")
         return challenge, 200
 
-    print("[ERROR] Webhook verification failed.")
+    logger.warning("Webhook verification failed.")
     return "Forbidden", 403
 
 
@@ -213,67 +781,47 @@ def handle_message():
     """
     All incoming Messenger events arrive here as POST requests.
 
-    Flow:
-      1. Extract sender ID + message from the payload
-      2. If it's a quick reply button tap → use PAYLOAD_REPLIES
-      3. If it's a greeting → send welcome message with buttons
-      4. Otherwise → look up a reply in Google Sheets
-      5. If nothing matches → send the fallback message (with buttons)
+    Events are handed to background workers (see _process_event)
+    and Meta gets its 200 right away, so slow Sheets or Send API calls
+    never delay the acknowledgement or trigger a redelivery.
+
+    Different senders are handled in parallel. Within this process,
+    one sender's events, including ones from later deliveries, are
+    queued and handled one at a time (see _queue_events) so their
+    replies arrive in order.
     """
     data = request.get_json()
 
     if data.get("object") != "page":
         return "Not a page event", 404
 
+    events_by_sender = {}
     for entry in data.get("entry", []):
         for event in entry.get("messaging", []):
+            msg = event.get("message")
 
-            sender_id = event["sender"]["id"]
-
-            if "message" not in event:
-                continue
-
-            msg = event["message"]
-
-            # Ignore echoes of our own outgoing messages
-            if msg.get("is_echo"):
-                continue
-
-            # ── CASE 1: User tapped a Quick Reply button ──────────────
-            if "quick_reply" in msg:
-                button_payload = msg["quick_reply"]["payload"]
-                reply = PAYLOAD_REPLIES.get(button_payload, FALLBACK_MESSAGE)
-                # After answering, show buttons again so user can keep exploring
-                send_message(sender_id, reply, quick_replies=QUICK_REPLY_BUTTONS)
+            # Skip echoes of our own messages and non-message events
+            # (deliveries, reads, ...) before doing any work on them
+            if not msg or msg.get("is_echo") or ("text" not in msg and "quick_reply" not in msg):
                 continue
 
-            # ── CASE 2: Text message ───────────────────────────────────
-            user_text = msg.get("text")
-            if not user_text:
-                continue
-
-            print(f"[MSG] From {sender_id}: {user_text}")
-            user_text_lower = user_text.lower().strip()
-
-            # Check if it's a greeting → send personalized welcome
-            if any(keyword in user_text_lower for keyword in GREETING_KEYWORDS):
-                send_welcome(sender_id)
-                continue
-
-            # Look up a reply in Google Sheets
-            sheet_reply = find_reply_from_sheet(user_text)
-            if sheet_reply:
-                send_message(sender_id, sheet_reply, quick_replies=QUICK_REPLY_BUTTONS)
-                continue
+            sender_id = event.get("sender", {}).get("id")
+            events_by_sender.setdefault(sender_id, []).append(event)
 
-            # Nothing matched → send fallback with buttons
-            send_message(sender_id, FALLBACK_MESSAGE, quick_replies=QUICK_REPLY_BUTTONS)
+    received_at = time.monotonic()
+    for sender_id, events in events_by_sender.items():
+        _queue_events(sender_id, events, received_at)
 
     return jsonify({"status": "ok"}), 200
 
 
 # ============================================================
 #  RUN SERVER
+#  In production, start the bot with gunicorn (settings are in
+#  gunicorn.conf.py):
+#    gunicorn app:app
+#  Running `python app.py` starts Flask's built-in development
+#  server, which is only meant for local testing.
 # ============================================================
 
 if __name__ == "__main__":
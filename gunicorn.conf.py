@@ -0,0 +1,28 @@
+# ============================================================
+#  GUNICORN SETTINGS — used automatically when you start with:
+#    gunicorn app:app
+#  (gunicorn picks up gunicorn.conf.py from the working directory)
+# ============================================================
+
+import os
+
+bind = f"0.0.0.0:{os.environ.get('PORT', 5000)}"
+
+# One process with a few request threads. The webhook only queues work
+# for the bot's own background threads (EVENT_WORKERS), so more processes
+# add little throughput.
+#
+# The bot keeps its state in memory, one copy per process: the sheet
+# cache, the name cache, per-sender reply order, repeated-greeting
+# filtering and the GRAPH_RATE_LIMIT budget. If you raise WEB_CONCURRENCY,
+# a sender's messages may be handled by different processes (so replies
+# can arrive out of order), the Graph rate limit applies per process
+# (divide GRAPH_RATE_LIMIT accordingly), and each process fetches the
+# sheet on its own.
+workers      = int(os.getenv("WEB_CONCURRENCY", 1))
+worker_class = "gthread"
+threads      = int(os.getenv("GUNICORN_THREADS", 8))
+
+# Keep the worker heartbeat file in memory instead of on disk
+if os.path.isdir("/dev/shm"):
+    worker_tmp_dir = "/dev/shm"